@@ -0,0 +1,98 @@
+import gzip
+import json
+import os
+
+import singer
+from singer.utils import now
+
+LOGGER = singer.get_logger()
+
+BATCH_MAX_RECORDS_DEFAULT = 100000
+BATCH_MAX_BYTES_DEFAULT = 100 * 1024 * 1024
+
+
+class BatchMessage(singer.Message):
+    # pylint: disable=super-init-not-called
+    def __init__(self, stream, manifest, encoding=None):
+        self.stream = stream
+        self.manifest = manifest
+        self.encoding = encoding or {'format': 'jsonl', 'compression': 'gzip'}
+
+    def asdict(self):
+        return {
+            'type': 'BATCH',
+            'stream': self.stream,
+            'encoding': self.encoding,
+            'manifest': self.manifest
+        }
+
+
+# Writes a stream's records to gzip-compressed JSONL files instead of RECORD
+# messages. Files rotate after max_records records or max_bytes of
+# uncompressed JSON. A BATCH message referencing a file is only written once
+# the file is closed and fsynced, and the checkpointer holds the stream's
+# position in STATE while a file has records that have not been announced.
+class BatchWriter:
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,
+                 directory,
+                 stream_name,
+                 checkpointer=None,
+                 max_records=BATCH_MAX_RECORDS_DEFAULT,
+                 max_bytes=BATCH_MAX_BYTES_DEFAULT):
+        self.directory = os.path.abspath(directory)
+        self.stream_name = stream_name
+        self.checkpointer = checkpointer
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.run_id = now().strftime('%Y%m%dT%H%M%S')
+        self.sequence = 0
+        self.path = None
+        self.raw_file = None
+        self.gzip_file = None
+        self.records = 0
+        self.bytes = 0
+
+    def open(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.sequence += 1
+        self.path = os.path.join(
+            self.directory, '{}-{}-{:05d}.jsonl.gz'.format(
+                self.stream_name, self.run_id, self.sequence))
+        self.raw_file = open('{}.part'.format(self.path), 'wb')  # pylint: disable=consider-using-with
+        self.gzip_file = gzip.GzipFile(fileobj=self.raw_file, mode='wb')
+        self.records = 0
+        self.bytes = 0
+        if self.checkpointer:
+            self.checkpointer.hold(self.stream_name)
+
+    # Same signature as singer.write_record so it can be swapped in
+    def write_record(self, stream_name, record): # pylint: disable = unused-argument
+        if self.gzip_file is None:
+            self.open()
+        line = (json.dumps(record, default=str) + '\n').encode('utf-8')
+        self.gzip_file.write(line)
+        self.records += 1
+        self.bytes += len(line)
+        if self.records >= self.max_records or self.bytes >= self.max_bytes:
+            self.close()
+
+    def close(self):
+        if self.gzip_file is None:
+            return
+        self.gzip_file.close()
+        self.raw_file.flush()
+        os.fsync(self.raw_file.fileno())
+        self.raw_file.close()
+        os.replace('{}.part'.format(self.path), self.path)
+        self.gzip_file = None
+        self.raw_file = None
+
+        LOGGER.info('Stream: %s - Closed batch %s with %s records',
+                    self.stream_name, self.path, self.records)
+        singer.write_message(
+            BatchMessage(self.stream_name, ['file://{}'.format(self.path)]))
+        if self.checkpointer:
+            self.checkpointer.release(self.stream_name)
@@ -1,11 +1,13 @@
 import singer
+from tap_ms_teams.schema_registry import get_schema
 
+# Only reads class attributes, so stream classes can be passed as they are
 def generate_catalog(streams):
 
     catalog = {}
     catalog['streams'] = []
     for stream in streams:
-        schema = stream.load_schema()
+        schema = get_schema(stream.name)
         catalog_entry = {
             'stream': stream.name,
             'tap_stream_id': stream.name,
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+
+import singer
+from singer.utils import now, strftime
+
+LOGGER = singer.get_logger()
+
+CHANGE_STORE_VERSION = 2
+
+
+# Keeps a compact key -> content hash map per stream on local disk, so that
+# FULL_TABLE streams only emit records that are new or changed since the
+# previous run. The map is rewritten atomically at the end of each stream
+# with only the keys seen in that run, which keeps it bounded by the size of
+# the stream; max_entries caps it further (evicted keys are simply re-emitted).
+# Child streams list the same object once per parent (a user is a member of
+# several groups), so records are keyed by their key properties together
+# with the injected parent ids.
+class ChangeStore:
+
+    def __init__(self, directory, stream_name, key_properties,
+                 parent_properties=None, max_entries=None):
+        self.path = os.path.join(directory, '{}.json'.format(stream_name))
+        self.parent_properties = parent_properties or []
+        self.key_properties = key_properties + self.parent_properties
+        self.max_entries = max_entries
+        self.previous = self.load()
+        self.seen = {}
+        self.kept_parents = []
+
+    # Stores written with other keys are dropped, so every record is emitted
+    # once and none is taken for deleted
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as store_file:
+                store = json.load(store_file)
+        except ValueError:
+            LOGGER.warning('Change store %s is unreadable, starting over',
+                           self.path)
+            return {}
+        if store.get('version') != CHANGE_STORE_VERSION or \
+                store.get('key_properties') != self.key_properties:
+            LOGGER.info('Change store %s has other keys, starting over',
+                        self.path)
+            return {}
+        return store['entries']
+
+    def get_key(self, record):
+        return json.dumps([record.get(key) for key in self.key_properties])
+
+    @staticmethod
+    def get_hash(record):
+        serialized = json.dumps(record, sort_keys=True, default=str)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()[:16]
+
+    # Records the record as seen and returns True when it should be emitted
+    def is_changed(self, record):
+        key = self.get_key(record)
+        record_hash = self.get_hash(record)
+        self.seen[key] = record_hash
+        return self.previous.get(key) != record_hash
+
+    # Entries of the previous run under these parents are carried over and
+    # never taken for deletions, e.g. children of a channel that could not be
+    # read this time. A parent sharing no property with the key, such as a
+    # team for a store keyed by channel, keeps every entry.
+    def keep_parents(self, parents):
+        self.kept_parents.extend(parents)
+
+    def is_kept(self, key):
+        values = dict(zip(self.key_properties, json.loads(key)))
+        return any(
+            all(values[prop] == value
+                for prop, value in parent.items()
+                if prop in self.parent_properties)
+            for parent in self.kept_parents)
+
+    def get_unseen_keys(self):
+        return [key for key in self.previous if key not in self.seen]
+
+    # Key-only records for keys stored by the previous run but not seen in
+    # this one, flagged with _sdc_deleted_at
+    def get_tombstones(self):
+        deleted_at = strftime(now())
+        tombstones = []
+        for key in self.get_unseen_keys():
+            if not self.is_kept(key):
+                tombstone = dict(zip(self.key_properties, json.loads(key)))
+                tombstone['_sdc_deleted_at'] = deleted_at
+                tombstones.append(tombstone)
+        return tombstones
+
+    def commit(self):
+        entries = self.seen
+        for key in self.get_unseen_keys():
+            if self.is_kept(key):
+                entries[key] = self.previous[key]
+        if self.max_entries and len(entries) > self.max_entries:
+            LOGGER.info('Change store %s compacted from %s to %s entries',
+                        self.path, len(entries), self.max_entries)
+            keys = sorted(entries)[:self.max_entries]
+            entries = {key: entries[key] for key in keys}
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w', encoding='utf-8') as store_file:
+            json.dump(
+                {
+                    'version': CHANGE_STORE_VERSION,
+                    'key_properties': self.key_properties,
+                    'entries': entries
+                },
+                store_file,
+                separators=(',', ':'))
+            store_file.flush()
+            os.fsync(store_file.fileno())
+        os.replace(tmp_path, self.path)
+        self.previous = entries
+        self.seen = {}
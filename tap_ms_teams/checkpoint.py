@@ -0,0 +1,119 @@
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+CHECKPOINT_INTERVAL_DEFAULT = 60
+CHECKPOINT_RECORDS_DEFAULT = 10000
+
+# Parts of state that record how far a stream has been emitted
+STREAM_STATE_SECTIONS = ['bookmarks', 'delta_links']
+
+
+# Coalesces state writes. Streams mark the state dirty as bookmarks move and
+# a STATE message is emitted at most once per interval seconds or
+# max_records records, whichever comes first. flush() writes immediately and
+# is used at stream boundaries; leaving the context flushes on exit.
+# A stream holds its position while it has records that are not yet
+# announced, e.g. in an open batch file: STATE keeps the stream's bookmark
+# and delta link as they were when the hold started until its last hold is
+# released, while other streams' positions are written as usual.
+# Streams syncing concurrently share one state, so every change to it is
+# made under lock.
+class Checkpointer:
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,
+                 state,
+                 interval=CHECKPOINT_INTERVAL_DEFAULT,
+                 max_records=CHECKPOINT_RECORDS_DEFAULT):
+        self.state = state
+        self.interval = interval
+        self.max_records = max_records
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.records = 0
+        self.holds = {}
+        self.held_positions = {}
+        self.syncing = []
+        self.last_write = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def increment(self, count=1):
+        with self.lock:
+            self.records += count
+
+    def is_due(self):
+        return self.records >= self.max_records or \
+            time.monotonic() - self.last_write >= self.interval
+
+    def checkpoint(self):
+        with self.lock:
+            self.dirty = True
+            if self.is_due():
+                self.flush()
+
+    def hold(self, stream_name):
+        with self.lock:
+            if not self.holds.get(stream_name):
+                self.held_positions[stream_name] = {
+                    section: self.state.get(section, {}).get(stream_name)
+                    for section in STREAM_STATE_SECTIONS
+                }
+            self.holds[stream_name] = self.holds.get(stream_name, 0) + 1
+
+    def release(self, stream_name):
+        with self.lock:
+            self.holds[stream_name] -= 1
+            if self.holds[stream_name] == 0:
+                del self.holds[stream_name]
+                del self.held_positions[stream_name]
+                self.dirty = True
+                self.flush()
+
+    # State with the positions of held streams rolled back
+    def get_writable_state(self):
+        if not self.held_positions:
+            return self.state
+        state = dict(self.state)
+        for stream_name, positions in self.held_positions.items():
+            for section, value in positions.items():
+                state[section] = dict(state.get(section, {}))
+                if value is None:
+                    state[section].pop(stream_name, None)
+                else:
+                    state[section][stream_name] = value
+        return state
+
+    # currently_syncing points at the earliest started stream that has not
+    # finished, so an interrupted run resumes from the oldest in-flight stream
+    def start_stream(self, stream_name):
+        with self.lock:
+            self.syncing.append(stream_name)
+            singer.set_currently_syncing(self.state, self.syncing[0])
+            self.flush(force=True)
+
+    def finish_stream(self, stream_name):
+        with self.lock:
+            self.syncing.remove(stream_name)
+            if self.syncing:
+                singer.set_currently_syncing(self.state, self.syncing[0])
+            elif 'currently_syncing' in self.state:
+                del self.state['currently_syncing']
+            self.flush(force=True)
+
+    def flush(self, force=False):
+        with self.lock:
+            if not (self.dirty or force):
+                return
+            singer.write_state(self.get_writable_state())
+            self.dirty = False
+            self.records = 0
+            self.last_write = time.monotonic()
@@ -16,7 +16,26 @@ TOKEN_URL = "https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
 SCOPE = "https://graph.microsoft.com/.default"
 BASE_GRAPH_URL = 'https://graph.microsoft.com'
 TOKEN_EXPIRATION_PERIOD = 3599
-TOP_API_PARAM_DEFAULT = 500
+REQUEST_TIMEOUT_DEFAULT = 300
+
+# Maximum $top accepted by Graph for each endpoint family (the path with
+# resource ids replaced by '*'). Families not listed here are requested
+# without $top and use the Graph default page size.
+PAGE_SIZE_LIMITS = {
+    'users': 999,
+    'groups': 999,
+    'groups/*/members': 999,
+    'groups/*/owners': 999,
+    'teams/*/channels/*/messages': 50,
+    'teams/*/channels/*/messages/delta': 50,
+    'teams/*/channels/*/messages/*/replies': 50,
+}
+PAGE_SIZE_MIN = 10
+PAGE_SIZE_SLOW_SECONDS = 20
+PAGE_SIZE_MAX_BYTES = 4 * 1024 * 1024
+PAGE_SIZE_HEALTHY_PAGES = 5
+CIRCUIT_BREAKER_THRESHOLD_DEFAULT = 10
+CIRCUIT_BREAKER_COOLDOWN_DEFAULT = 300
 
 class GraphVersion(Enum):
     BETA = 'beta'
@@ -31,7 +50,177 @@ class Server42xRateLimitError(Exception):
     pass
 
 
+class Server401Error(Exception):
+    pass
+
+
+# 403 or 404 on a GET, e.g. a private channel the app cannot read or a
+# channel deleted since it was listed
+class ResourceUnavailableError(Exception):
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# Replace resource ids in a Graph path with '*', keeping collection names
+#  e.g. teams/abc/channels/19:xyz/messages -> teams/*/channels/*/messages
+def get_endpoint_family(path):
+    segments = path.strip('/').split('/')
+    return '/'.join(
+        segment if i % 2 == 0 or segment == 'delta' else '*'
+        for i, segment in enumerate(segments))
+
+
+# Tunes $top per endpoint family. Starts at the Graph maximum, halves after
+# a throttled, slow or oversized page and doubles back towards the maximum
+# after a run of healthy pages. Tuned values live in the page_sizes dict,
+# which sync() keeps in state so they carry over between runs; lock guards
+# it against concurrent state writes.
+class PageSizer:
+
+    def __init__(self, page_sizes=None, lock=None):
+        self.page_sizes = page_sizes if page_sizes is not None else {}
+        self.lock = lock or threading.RLock()
+        self.healthy_pages = {}
+
+    def get_top(self, family):
+        if family not in PAGE_SIZE_LIMITS:
+            return None
+        return self.page_sizes.get(family, PAGE_SIZE_LIMITS[family])
+
+    def back_off(self, family):
+        top = self.get_top(family)
+        if top is None:
+            return
+        with self.lock:
+            self.page_sizes[family] = max(PAGE_SIZE_MIN, top // 2)
+            self.healthy_pages[family] = 0
+        LOGGER.info('Reducing page size for %s to %s', family,
+                    max(PAGE_SIZE_MIN, top // 2))
+
+    def observe(self, family, elapsed, size):
+        top = self.get_top(family)
+        if top is None:
+            return
+        if elapsed > PAGE_SIZE_SLOW_SECONDS or size > PAGE_SIZE_MAX_BYTES:
+            self.back_off(family)
+            return
+        with self.lock:
+            self.healthy_pages[family] = self.healthy_pages.get(family, 0) + 1
+            if self.healthy_pages[family] < PAGE_SIZE_HEALTHY_PAGES or \
+                    top >= PAGE_SIZE_LIMITS[family]:
+                return
+            self.page_sizes[family] = min(PAGE_SIZE_LIMITS[family], top * 2)
+            self.healthy_pages[family] = 0
+        LOGGER.info('Increasing page size for %s to %s', family,
+                    min(PAGE_SIZE_LIMITS[family], top * 2))
+
+
+# Stops requests to an endpoint family during a 5xx storm. After threshold
+# consecutive 5xx responses the circuit opens and requests to the family fail
+# fast with CircuitOpenError for cooldown seconds, so streams move on to
+# other parents and families instead of retrying. Once the cooldown is over
+# requests go through again; the first 5xx reopens the circuit and the first
+# success closes it.
+class CircuitBreaker:
+
+    def __init__(self,
+                 threshold=CIRCUIT_BREAKER_THRESHOLD_DEFAULT,
+                 cooldown=CIRCUIT_BREAKER_COOLDOWN_DEFAULT):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.opened_at = {}
+
+    def before_request(self, family):
+        with self.lock:
+            opened_at = self.opened_at.get(family)
+        if opened_at is not None and time.time() - opened_at < self.cooldown:
+            raise CircuitOpenError(
+                'Circuit open for {}, skipping request'.format(family))
+
+    def record_success(self, family):
+        with self.lock:
+            self.failures.pop(family, None)
+            if self.opened_at.pop(family, None) is not None:
+                LOGGER.info('Circuit closed for %s', family)
+
+    def record_failure(self, family):
+        with self.lock:
+            self.failures[family] = self.failures.get(family, 0) + 1
+            if self.failures[family] < self.threshold and \
+                    family not in self.opened_at:
+                return
+            self.opened_at[family] = time.time()
+        LOGGER.warning('Circuit open for %s for %s seconds after %s server errors',
+                       family, self.cooldown, self.failures[family])
+
+
+# Per stream request statistics by endpoint family, kept in state as
+# run_stats by sync() and read by the --plan estimator. The stream being
+# synced is tracked per thread so concurrent streams are counted apart.
+# Skipped child resources are counted by reason; deferred skips (server
+# errors, open circuit) leave the stream incomplete. Parents whose children
+# may still exist (anything but 404) are kept so their previously seen
+# children are not taken for deletions.
+class RequestStats:
+
+    DEFERRED_REASONS = ['server_error', 'circuit_open']
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def start_stream(self):
+        self.local.families = {}
+        self.local.skipped = {}
+        self.local.skipped_parents = []
+
+    def finish_stream(self):
+        families = getattr(self.local, 'families', None) or {}
+        self.local.families = None
+        return families
+
+    def record(self, family, **counts):
+        families = getattr(self.local, 'families', None)
+        if families is None:
+            return
+        stats = families.setdefault(family, {
+            'collections': 0,
+            'requests': 0,
+            'items': 0,
+            'seconds': 0.0,
+            'throttle_seconds': 0
+        })
+        for key, value in counts.items():
+            stats[key] += value
+
+    def record_skip(self, reason, parent=None):
+        skipped = getattr(self.local, 'skipped', None)
+        if skipped is None:
+            return
+        skipped[reason] = skipped.get(reason, 0) + 1
+        if parent is not None and reason != 'not_found':
+            self.local.skipped_parents.append(parent)
+
+    def get_skipped(self):
+        return dict(getattr(self.local, 'skipped', None) or {})
+
+    def get_skipped_parents(self):
+        return list(getattr(self.local, 'skipped_parents', None) or [])
+
+    def is_incomplete(self):
+        skipped = self.get_skipped()
+        return any(skipped.get(reason) for reason in self.DEFERRED_REASONS)
+
+
 class MicrosoftGraphClient:
+    # pylint: disable=too-many-instance-attributes
 
     MAX_TRIES = 5
 
@@ -39,10 +228,26 @@ class MicrosoftGraphClient:
         self.config = config
         self.session = requests.Session()
         self.login_timer = None
+        self.login_lock = threading.Lock()
         self.access_token = None
         self.client_secret = None
         self.client_id = None
         self.tenant_id = None
+        self.page_sizer = PageSizer()
+        self.stats = RequestStats()
+        self.request_timeout = config.get('request_timeout',
+                                          REQUEST_TIMEOUT_DEFAULT)
+        self.circuit_breaker = CircuitBreaker(
+            threshold=config.get('circuit_breaker_threshold',
+                                 CIRCUIT_BREAKER_THRESHOLD_DEFAULT),
+            cooldown=config.get('circuit_breaker_cooldown',
+                                CIRCUIT_BREAKER_COOLDOWN_DEFAULT))
+
+    # Returns the endpoint family of a full Graph URL, dropping the version
+    @staticmethod
+    def get_url_family(url):
+        path = urllib.parse.urlparse(url).path.strip('/')
+        return get_endpoint_family(path.split('/', 1)[-1])
 
     @staticmethod
     def build_url(baseurl, version, path, args_dict):
@@ -52,32 +257,44 @@ class MicrosoftGraphClient:
         url_parts[4] = urllib.parse.urlencode(args_dict)
         return urllib.parse.urlunparse(url_parts)
 
-    def login(self):
-        LOGGER.info("Refreshing token")
-        self.client_id = self.config.get('client_id')
-        self.client_secret = self.config.get('client_secret')
-        self.tenant_id = self.config.get('tenant_id')
-
-        try:
-            body = {
-                'grant_type': 'client_credentials',
-                'client_id': self.client_id,
-                'client_secret': self.client_secret,
-                'scope': SCOPE
-            }
-
-            with singer.http_request_timer('POST get access token'):
-                result = self.make_request(
-                    method='POST',
-                    url=TOKEN_URL.format(tenant_id=self.tenant_id),
-                    data=body)
-
-            self.access_token = result.get('access_token')
-
-        finally:
-            self.login_timer = threading.Timer(TOKEN_EXPIRATION_PERIOD,
-                                               self.login)
-            self.login_timer.start()
+    # Streams running in parallel can all get a 401 when the token expires.
+    # The refresh runs under login_lock and is skipped when another thread
+    # already replaced expired_token, so only one timer is ever scheduled. The
+    # timer is a daemon so a missed cancel cannot keep the process alive.
+    def login(self, expired_token=None):
+        with self.login_lock:
+            if expired_token is not None and \
+                    self.access_token != expired_token:
+                return
+            LOGGER.info("Refreshing token")
+            # Logging in again after a 401 replaces the scheduled refresh
+            if self.login_timer:
+                self.login_timer.cancel()
+            self.client_id = self.config.get('client_id')
+            self.client_secret = self.config.get('client_secret')
+            self.tenant_id = self.config.get('tenant_id')
+
+            try:
+                body = {
+                    'grant_type': 'client_credentials',
+                    'client_id': self.client_id,
+                    'client_secret': self.client_secret,
+                    'scope': SCOPE
+                }
+
+                with singer.http_request_timer('POST get access token'):
+                    result = self.make_request(
+                        method='POST',
+                        url=TOKEN_URL.format(tenant_id=self.tenant_id),
+                        data=body)
+
+                self.access_token = result.get('access_token')
+
+            finally:
+                self.login_timer = threading.Timer(TOKEN_EXPIRATION_PERIOD,
+                                                   self.login)
+                self.login_timer.daemon = True
+                self.login_timer.start()
 
 
     def get_all_resources(self,
@@ -85,38 +302,127 @@ class MicrosoftGraphClient:
                           endpoint,
                           top=None,
                           orderby=None,
-                          filter_param=None):
+                          filter_param=None,
+                          expand=None):
+        response = []
+        for page in self.get_resource_pages(version,
+                                            endpoint,
+                                            top=top,
+                                            orderby=orderby,
+                                            filter_param=filter_param,
+                                            expand=expand):
+            response.extend(page)
+        return response
+
+    # Yields each page of a collection as it is received, so callers that only
+    # need part of each resource do not hold the whole collection
+    def get_resource_pages(self,
+                           version,
+                           endpoint,
+                           top=None,
+                           orderby=None,
+                           filter_param=None,
+                           expand=None):
         args = {}
+        family = get_endpoint_family(endpoint)
 
+        if top is None:
+            top = self.page_sizer.get_top(family)
         if top:
             args['$top'] = top
         if orderby:
             args["$orderby"] = orderby
         if filter_param:
             args["$filter"] = filter_param
+        if expand:
+            args["$expand"] = expand
 
         next_url = self.build_url(BASE_GRAPH_URL, version, endpoint, args)
 
+        self.stats.record(family, collections=1)
+        while next_url:
+            LOGGER.info("Making request GET %s", next_url)
+            body = self.make_request('GET', url=next_url)
+            if body:
+                next_url = body.get('@odata.nextLink', None)
+                self.stats.record(family, items=len(body.get('value')))
+                yield body.get('value')
+            else:
+                next_url = None
+
+
+    # Children of a team, channel, conversation or message that cannot be read
+    # are skipped and reported instead of failing the sync: 403/404 for good,
+    # server errors and open circuits until the next run. Pages received
+    # before the failure are kept. parent holds the parent ids injected into
+    # the children, e.g. {'group_id': ...}.
+    def get_child_resources(self, version, endpoint, parent=None, **kwargs):
+        response = []
+        try:
+            for page in self.get_resource_pages(version, endpoint, **kwargs):
+                response.extend(page)
+        except ResourceUnavailableError as err:
+            reason = 'forbidden' if err.status_code == 403 else 'not_found'
+            self.skip(endpoint, reason, err, parent)
+        except Server5xxError as err:
+            self.skip(endpoint, 'server_error', err, parent)
+        except CircuitOpenError as err:
+            self.skip(endpoint, 'circuit_open', err, parent)
+        return response
+
+    def skip(self, endpoint, reason, err, parent=None):
+        LOGGER.warning('Skipping %s (%s): %s', endpoint, reason, err)
+        self.stats.record_skip(reason, parent)
+
+
+    def get_resource(self, version, endpoint, select=None):
+        args = {}
+        if select:
+            args['$select'] = select
+        url = self.build_url(BASE_GRAPH_URL, version, endpoint, args)
+        self.stats.record(get_endpoint_family(endpoint), collections=1, items=1)
+        LOGGER.info("Making request GET %s", url)
+        return self.make_request('GET', url=url)
+
+
+    # Follow a delta query to the end of its current round. Resumes from
+    # delta_link when given, and returns the resources along with the
+    # @odata.deltaLink to resume from on the next run.
+    # See, https://docs.microsoft.com/en-us/graph/delta-query-overview
+    def get_delta_resources(self, version, endpoint, delta_link=None):
+        if delta_link:
+            next_url = delta_link
+        else:
+            next_url = self.build_url(BASE_GRAPH_URL, version, endpoint, {})
+
+        family = get_endpoint_family(endpoint)
+        self.stats.record(family, collections=1)
         response = []
+        next_delta_link = None
         while next_url:
             LOGGER.info("Making request GET %s", next_url)
             body = self.make_request('GET', url=next_url)
             if body:
                 next_url = body.get('@odata.nextLink', None)
+                next_delta_link = body.get('@odata.deltaLink',
+                                           next_delta_link)
                 data = body.get('value')
+                self.stats.record(family, items=len(data))
                 response.extend(data)
             else:
                 next_url = None
-        return response
+        return response, next_delta_link
 
 
     @backoff.on_exception(
         backoff.expo,
-        (Server5xxError, ConnectionError, Server42xRateLimitError),
+        (Server5xxError, ConnectionError, Server42xRateLimitError,
+         Server401Error),
         max_tries=5,
         factor=2)
     def get_report(self, version, endpoint):
-        headers = {'Authorization': 'Bearer {}'.format(self.access_token)}
+        access_token = self.access_token
+        headers = {'Authorization': 'Bearer {}'.format(access_token)}
         if self.config.get('user_agent'):
             headers['User-Agent'] = self.config['user_agent']
 
@@ -127,8 +433,9 @@ class MicrosoftGraphClient:
 
         if response.status_code == 401:
             LOGGER.info("Received unauthorized error code, retrying: %s", response.text)
-            self.login()
-        elif response.status_code == 429:
+            self.login(expired_token=access_token)
+            raise Server401Error(response.text)
+        if response.status_code == 429:
             retry_after = int(response.headers.get('Retry-After'))
             LOGGER.info("Received rate limit response sleeping for : %s", retry_after)
             time.sleep(retry_after)
@@ -163,21 +470,47 @@ class MicrosoftGraphClient:
                 yield batch
 
 
+    # Each call is one page of an @odata.nextLink chain, so a failed page is
+    # retried on its own
     @backoff.on_exception(
         backoff.expo,
-        (Server5xxError, ConnectionError, Server42xRateLimitError),
+        (Server5xxError, ConnectionError, Server42xRateLimitError,
+         requests.exceptions.Timeout, Server401Error),
         max_tries=5,
         factor=2)
     def make_request(self, method, url=None, params=None, data=None):
 
-        headers = {'Authorization': 'Bearer {}'.format(self.access_token)}
+        access_token = self.access_token
+        headers = {'Authorization': 'Bearer {}'.format(access_token)}
 
         if self.config.get('user_agent'):
             headers['User-Agent'] = self.config['user_agent']
 
         if method == "GET":
             LOGGER.info("Making %s request to %s with params: %s", method, url, params)
-            response = self.session.get(url, headers=headers, allow_redirects=True)
+            family = self.get_url_family(url)
+            self.circuit_breaker.before_request(family)
+            start = time.time()
+            try:
+                response = self.session.get(url,
+                                            headers=headers,
+                                            allow_redirects=True,
+                                            timeout=self.request_timeout)
+            except requests.exceptions.Timeout:
+                self.page_sizer.back_off(family)
+                raise
+            finally:
+                self.stats.record(family,
+                                  requests=1,
+                                  seconds=time.time() - start)
+            if response.status_code == 429:
+                self.page_sizer.back_off(family)
+            elif response.status_code >= 500:
+                self.circuit_breaker.record_failure(family)
+            elif response.status_code in [200, 201, 202]:
+                self.circuit_breaker.record_success(family)
+                self.page_sizer.observe(family, time.time() - start,
+                                        len(response.content))
         elif method == "POST":
             LOGGER.info("Making %s request to %s with body %s", method, url, data)
             response = self.session.post(url, data=data)
@@ -186,13 +519,20 @@ class MicrosoftGraphClient:
 
         LOGGER.info("Received code: %s", response.status_code)
 
-        if response.status_code == 401:
+        # A token refused before its scheduled refresh is renewed and the same
+        # request re-issued; a 401 from the token endpoint itself is final
+        if response.status_code == 401 and method == "GET":
             LOGGER.info(
                 "Received unauthorized error code, retrying: %s", response.text)
-            self.login()
-        elif response.status_code == 429:
+            self.login(expired_token=access_token)
+            raise Server401Error(response.text)
+        if response.status_code in [403, 404] and method == "GET":
+            raise ResourceUnavailableError(response.status_code, response.text)
+        if response.status_code == 429:
             LOGGER.info("Received rate limit response: %s", response.headers)
             retry_after = int(response.headers.get('Retry-After'))
+            if method == "GET":
+                self.stats.record(family, throttle_seconds=retry_after)
             time.sleep(retry_after)
             raise Server42xRateLimitError()
         elif response.status_code >= 500:
@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import singer
+
+LOGGER = singer.get_logger()
+
+PARENT_INDEX_MEMORY_LIMIT_DEFAULT = 100000
+
+
+# Compact index of parent ids used by child stream traversals, e.g.
+# (group_id,) for teams or (group_id, channel_id) for channels. Entries are
+# plain tuples kept in insertion order. Without a directory they stay in
+# memory. With one, they move to a local SQLite file past memory_limit
+# entries while building, so memory stays flat however large the tenant, and
+# every completed index is written there and read back from disk.
+# Completed files are reused by later streams and runs while younger than
+# parent_index_max_age and built with the same scope fingerprint. Builders
+# clear complete when parents were skipped, and such files are never reused.
+class ParentIndex:
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,
+                 name,
+                 width,
+                 directory=None,
+                 memory_limit=PARENT_INDEX_MEMORY_LIMIT_DEFAULT,
+                 fingerprint=''):
+        self.name = name
+        self.width = width
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.fingerprint = fingerprint
+        self.entries = []
+        self.connection = None
+        self.count = 0
+        self.tmp_path = None
+        self.read_path = None
+        self.complete = True
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, '{}.sqlite'.format(self.name))
+
+    def get_columns(self):
+        return ', '.join('id{}'.format(i) for i in range(self.width))
+
+    def add(self, ids):
+        self.count += 1
+        if self.connection is not None:
+            self.insert([ids])
+            return
+        self.entries.append(tuple(ids))
+        if self.directory and len(self.entries) > self.memory_limit:
+            self.spill()
+
+    # Each builder writes its own temporary file so that streams building the
+    # same index concurrently do not collide; finish() moves it into place.
+    def spill(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.tmp_path = '{}.{}.tmp'.format(self.path, threading.get_ident())
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.connection = sqlite3.connect(self.tmp_path)
+        self.connection.execute(
+            'CREATE TABLE entries (seq INTEGER PRIMARY KEY, {})'.format(
+                self.get_columns()))
+        self.connection.execute(
+            'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.insert(self.entries)
+        LOGGER.info('Parent index %s spilled to %s after %s entries',
+                    self.name, self.tmp_path, len(self.entries))
+        self.entries = []
+
+    def insert(self, entries):
+        self.connection.executemany(
+            'INSERT INTO entries ({}) VALUES ({})'.format(
+                self.get_columns(), ', '.join('?' * self.width)), entries)
+
+    def finish(self):
+        if not self.directory:
+            return
+        if self.connection is None:
+            self.spill()
+        self.connection.executemany(
+            'INSERT INTO meta (key, value) VALUES (?, ?)',
+            [('created_at', str(time.time() if self.complete else 0)),
+             ('fingerprint', self.fingerprint)])
+        self.connection.commit()
+        self.connection.close()
+        self.connection = None
+        os.replace(self.tmp_path, self.path)
+        self.read_path = self.path
+
+    @classmethod
+    def load(cls, name, width, directory, max_age, fingerprint=''):
+        index = cls(name, width, directory=directory, fingerprint=fingerprint)
+        if not os.path.exists(index.path):
+            return None
+        with closing(sqlite3.connect(index.path)) as connection:
+            try:
+                meta = dict(connection.execute('SELECT key, value FROM meta'))
+                count = connection.execute(
+                    'SELECT COUNT(*) FROM entries').fetchone()[0]
+            except sqlite3.DatabaseError:
+                return None
+        age = time.time() - float(meta.get('created_at', 0))
+        if age > max_age or meta.get('fingerprint') != fingerprint:
+            return None
+        index.read_path = index.path
+        index.count = count
+        LOGGER.info('Reusing parent index %s with %s entries, %ds old', name,
+                    count, age)
+        return index
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        if self.read_path is None:
+            return iter(self.entries)
+        return self.read_entries()
+
+    # Each traversal opens its own connection, closed once it is exhausted or
+    # abandoned
+    def read_entries(self):
+        with closing(sqlite3.connect(self.read_path)) as connection:
+            yield from connection.execute(
+                'SELECT {} FROM entries ORDER BY seq'.format(
+                    self.get_columns()))
+
+
+# Returns a reusable index when one is fresh enough, otherwise builds one by
+# calling build_fn(index)
+def get_parent_index(config, name, width, build_fn, fingerprint=''):
+    config = config or {}
+    directory = config.get('parent_index_dir')
+    max_age = config.get('parent_index_max_age', 0)
+    if directory and max_age:
+        index = ParentIndex.load(name, width, directory, max_age, fingerprint)
+        if index is not None:
+            return index
+
+    index = ParentIndex(name,
+                        width,
+                        directory=directory,
+                        memory_limit=config.get(
+                            'parent_index_memory_limit',
+                            PARENT_INDEX_MEMORY_LIMIT_DEFAULT),
+                        fingerprint=fingerprint)
+    build_fn(index)
+    index.finish()
+    return index
@@ -0,0 +1,102 @@
+import math
+
+import singer
+from tap_ms_teams.client import PAGE_SIZE_LIMITS
+from tap_ms_teams.scheduler import MAX_CONCURRENT_STREAMS_DEFAULT
+
+LOGGER = singer.get_logger()
+
+PLAN_WINDOW_SECONDS_DEFAULT = 3600
+PLAN_MAX_CONCURRENT_STREAMS = 8
+# Above this share of time spent waiting on Retry-After, more concurrency
+# only adds throttling
+PLAN_THROTTLE_RATIO_LIMIT = 0.1
+
+
+# Requests for an endpoint family at the current page size: at least one per
+# collection listed, otherwise enough pages to hold the items seen last run
+def estimate_family_requests(family, stats, page_sizes):
+    top = page_sizes.get(family) or PAGE_SIZE_LIMITS.get(family)
+    if not top or not stats['items']:
+        return stats['requests']
+    return max(stats['collections'], int(math.ceil(stats['items'] / top)))
+
+
+def estimate_stream(stream_name, stats, page_sizes):
+    requests = 0
+    request_seconds = 0.0
+    throttle_seconds = 0
+    observed_seconds = 0.0
+    for family, family_stats in stats.get('families', {}).items():
+        family_requests = estimate_family_requests(family, family_stats,
+                                                   page_sizes)
+        latency = family_stats['seconds'] / max(family_stats['requests'], 1)
+        requests += family_requests
+        request_seconds += family_requests * latency
+        throttle_seconds += family_stats['throttle_seconds']
+        observed_seconds += family_stats['seconds'] + \
+            family_stats['throttle_seconds']
+
+    # Time not spent on requests (transform, output) is carried over as is
+    other_seconds = max(0.0, stats.get('seconds', 0) - observed_seconds)
+    return {
+        'stream': stream_name,
+        'requests': requests,
+        'throttle_seconds': throttle_seconds,
+        'duration_seconds': round(request_seconds + throttle_seconds +
+                                  other_seconds, 1)
+    }
+
+
+# Estimates requests, throttling and duration per selected stream from the
+# run_stats and page_sizes a previous sync left in state, and recommends
+# max_concurrent_streams and a number of team shards (runs split with
+# include_group_ids) that fit plan_window_seconds.
+def plan(config, catalog, state):
+    state = state or {}
+    page_sizes = state.get('page_sizes', {})
+    run_stats = state.get('run_stats', {})
+
+    streams = []
+    unknown = []
+    for catalog_entry in catalog.get_selected_streams(state):
+        stats = run_stats.get(catalog_entry.stream)
+        if stats is None:
+            unknown.append(catalog_entry.stream)
+            continue
+        streams.append(
+            estimate_stream(catalog_entry.stream, stats, page_sizes))
+
+    if unknown:
+        LOGGER.warning('No statistics from a previous run for: %s',
+                       ', '.join(unknown))
+
+    total_seconds = sum(stream['duration_seconds'] for stream in streams)
+    longest_seconds = max(
+        [stream['duration_seconds'] for stream in streams] or [0])
+    throttle_seconds = sum(stream['throttle_seconds'] for stream in streams)
+
+    concurrency = MAX_CONCURRENT_STREAMS_DEFAULT
+    if longest_seconds:
+        concurrency = min(len(streams), PLAN_MAX_CONCURRENT_STREAMS,
+                          int(math.ceil(total_seconds / longest_seconds)))
+    if total_seconds and \
+            throttle_seconds / total_seconds > PLAN_THROTTLE_RATIO_LIMIT:
+        concurrency = max(1, concurrency // 2)
+
+    duration_seconds = max(longest_seconds,
+                           total_seconds / max(concurrency, 1))
+    window_seconds = config.get('plan_window_seconds',
+                                PLAN_WINDOW_SECONDS_DEFAULT)
+
+    return {
+        'streams': streams,
+        'streams_without_statistics': unknown,
+        'total_requests': sum(stream['requests'] for stream in streams),
+        'throttle_seconds': throttle_seconds,
+        'sequential_duration_seconds': round(total_seconds, 1),
+        'recommended_max_concurrent_streams': concurrency,
+        'estimated_duration_seconds': round(duration_seconds, 1),
+        'recommended_shards': max(
+            1, int(math.ceil(duration_seconds / window_seconds)))
+    }
@@ -0,0 +1,141 @@
+import cProfile
+import collections
+import os
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import singer
+
+LOGGER = singer.get_logger()
+
+PROFILE_MODES = ['full', 'sample']
+PROFILE_TOP_N_DEFAULT = 25
+PROFILE_SAMPLE_INTERVAL_DEFAULT = 0.05
+
+
+# Samples the stack of one thread at a fixed interval. Cheap enough to leave
+# on in production: the profiled thread is never instrumented, it is only
+# observed from a background thread.
+class StackSampler(threading.Thread):
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.samples = 0
+        self.own_counts = collections.Counter()
+        self.total_counts = collections.Counter()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            # pylint: disable=protected-access
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own_counts[self.describe(frame)] += 1
+            seen = set()
+            while frame is not None:
+                location = self.describe(frame)
+                if location not in seen:
+                    self.total_counts[location] += 1
+                    seen.add(location)
+                frame = frame.f_back
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    @staticmethod
+    def describe(frame):
+        code = frame.f_code
+        return '{}:{}({})'.format(code.co_filename, code.co_firstlineno,
+                                  code.co_name)
+
+
+# Wraps each stream's sync when profile_dir is configured.
+#  full: cProfile dump (<stream>.prof) and top-N tracemalloc allocation
+#   report (<stream>.alloc.txt)
+#  sample: stack sampling report (<stream>.samples.txt)
+class StreamProfiler:
+
+    def __init__(self,
+                 directory=None,
+                 mode='full',
+                 top_n=PROFILE_TOP_N_DEFAULT,
+                 sample_interval=PROFILE_SAMPLE_INTERVAL_DEFAULT):
+        if mode not in PROFILE_MODES:
+            raise ValueError('Unsupported profile_mode {}, expected one of {}'
+                             .format(mode, PROFILE_MODES))
+        self.directory = directory
+        self.mode = mode
+        self.top_n = top_n
+        self.sample_interval = sample_interval
+
+    def get_path(self, stream_name, suffix):
+        return os.path.join(self.directory,
+                            '{}.{}'.format(stream_name, suffix))
+
+    @contextmanager
+    def profile(self, stream_name):
+        if not self.directory:
+            yield
+            return
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        if self.mode == 'sample':
+            with self.sample(stream_name):
+                yield
+        else:
+            with self.trace(stream_name):
+                yield
+
+    @contextmanager
+    def trace(self, stream_name):
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+            profile_path = self.get_path(stream_name, 'prof')
+            profiler.dump_stats(profile_path)
+
+            alloc_path = self.get_path(stream_name, 'alloc.txt')
+            with open(alloc_path, 'w', encoding='utf-8') as report:
+                report.write('Top {} allocations for {}\n'.format(
+                    self.top_n, stream_name))
+                for stat in snapshot.statistics('lineno')[:self.top_n]:
+                    report.write('{}\n'.format(stat))
+            LOGGER.info('Stream: %s - Profile written to %s and %s',
+                        stream_name, profile_path, alloc_path)
+
+    @contextmanager
+    def sample(self, stream_name):
+        sampler = StackSampler(threading.get_ident(), self.sample_interval)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+
+            samples_path = self.get_path(stream_name, 'samples.txt')
+            with open(samples_path, 'w', encoding='utf-8') as report:
+                report.write('{} samples every {}s for {}\n'.format(
+                    sampler.samples, self.sample_interval, stream_name))
+                for title, counts in [('Own time', sampler.own_counts),
+                                      ('Total time', sampler.total_counts)]:
+                    report.write('\n{}\n'.format(title))
+                    for location, count in counts.most_common(self.top_n):
+                        report.write('{:6.1%} {}\n'.format(
+                            count / max(sampler.samples, 1), location))
+            LOGGER.info('Stream: %s - Samples written to %s', stream_name,
+                        samples_path)
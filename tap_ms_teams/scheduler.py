@@ -0,0 +1,64 @@
+import sys
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import singer
+
+LOGGER = singer.get_logger()
+
+MAX_CONCURRENT_STREAMS_DEFAULT = 1
+
+
+# Serializes writes to the wrapped stream. singer writes each message with a
+# single write() call, so this keeps messages from concurrent streams whole.
+class AtomicWriter:
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            return self.stream.write(data)
+
+    def flush(self):
+        with self.lock:
+            return self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+# Runs sync_fn for each catalog entry, at most max_workers at a time, in the
+# order given. Streams in this tap do not depend on each other's output, so
+# any selected stream may run alongside any other. The first failure stops
+# streams that have not started yet and is re-raised once running streams
+# have finished.
+class StreamScheduler:
+
+    def __init__(self, max_workers=MAX_CONCURRENT_STREAMS_DEFAULT):
+        self.max_workers = max(1, max_workers)
+
+    def run(self, catalog_entries, sync_fn):
+        if self.max_workers == 1:
+            for catalog_entry in catalog_entries:
+                sync_fn(catalog_entry)
+            return
+
+        LOGGER.info('Syncing up to %s streams concurrently', self.max_workers)
+        stdout = sys.stdout
+        sys.stdout = AtomicWriter(stdout)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(sync_fn, catalog_entry)
+                    for catalog_entry in catalog_entries
+                ]
+                _, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in not_done:
+                    future.cancel()
+            for future in futures:
+                if not future.cancelled() and future.exception():
+                    raise future.exception()
+        finally:
+            sys.stdout = stdout
@@ -0,0 +1,39 @@
+import os
+import threading
+
+import singer
+
+SCHEMAS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                           'schemas')
+
+
+# Stream schemas keyed by stream name. The schemas directory is read once per
+# process, on first use, and the parsed schemas are shared by discovery and
+# every stream, so callers must not modify them.
+class SchemaRegistry:
+
+    def __init__(self, directory=SCHEMAS_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.schemas = None
+
+    def load(self):
+        with self.lock:
+            if self.schemas is None:
+                self.schemas = {
+                    filename[:-len('.json')]: singer.utils.load_json(
+                        os.path.join(self.directory, filename))
+                    for filename in sorted(os.listdir(self.directory))
+                    if filename.endswith('.json')
+                }
+        return self.schemas
+
+    def get(self, name):
+        return self.load()[name]
+
+
+SCHEMA_REGISTRY = SchemaRegistry()
+
+
+def get_schema(name):
+    return SCHEMA_REGISTRY.get(name)
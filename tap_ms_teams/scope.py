@@ -0,0 +1,95 @@
+import hashlib
+import json
+import re
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Graph limits the number of values in an "in" filter
+# See, https://docs.microsoft.com/en-us/graph/aad-advanced-queries
+FILTER_IN_MAX_VALUES = 15
+
+SCOPE_CONFIG_KEYS = [
+    'include_group_ids', 'exclude_group_ids', 'include_group_names',
+    'exclude_group_names', 'channel_membership_types', 'exclude_archived'
+]
+
+
+def format_in_filter(prop, values):
+    return "{} in ({})".format(
+        prop, ', '.join("'{}'".format(value) for value in values))
+
+
+# Config-driven include/exclude rules for the team/channel hierarchy.
+# Group ids and channel membership types are pushed into $filter; name
+# patterns (regular expressions, matched anywhere in the display name) and
+# the archived flag are evaluated before any child of the team or channel
+# is requested.
+class HierarchyScope:
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.config_values = {key: config.get(key) for key in SCOPE_CONFIG_KEYS}
+        self.include_group_ids = config.get('include_group_ids') or []
+        self.exclude_group_ids = set(config.get('exclude_group_ids') or [])
+        self.include_group_names = [
+            re.compile(pattern)
+            for pattern in config.get('include_group_names') or []
+        ]
+        self.exclude_group_names = [
+            re.compile(pattern)
+            for pattern in config.get('exclude_group_names') or []
+        ]
+        self.channel_membership_types = config.get(
+            'channel_membership_types') or []
+        self.exclude_archived = config.get('exclude_archived', False)
+
+    # Identifies the scope, so indexes built under another scope are not reused
+    def fingerprint(self):
+        return hashlib.sha1(
+            json.dumps(self.config_values,
+                       sort_keys=True).encode('utf-8')).hexdigest()
+
+    # One filter per chunk of included ids, ANDed with base_filter
+    def get_group_filters(self, base_filter):
+        if not self.include_group_ids:
+            return [base_filter]
+        return [
+            '{} and {}'.format(
+                base_filter,
+                format_in_filter('id', self.include_group_ids[
+                    i:i + FILTER_IN_MAX_VALUES]))
+            for i in range(0, len(self.include_group_ids),
+                           FILTER_IN_MAX_VALUES)
+        ]
+
+    def is_group_selected(self, group):
+        group_id = group.get('id')
+        if self.include_group_ids and group_id not in self.include_group_ids:
+            return False
+        if group_id in self.exclude_group_ids:
+            return False
+
+        # Delta pages may omit displayName, name rules only apply when present
+        name = group.get('displayName')
+        if name is None:
+            return True
+        if self.include_group_names and not any(
+                pattern.search(name) for pattern in self.include_group_names):
+            return False
+        return not any(
+            pattern.search(name) for pattern in self.exclude_group_names)
+
+    def get_channel_filter(self):
+        if not self.channel_membership_types:
+            return None
+        return ' or '.join(
+            "membershipType eq '{}'".format(membership_type)
+            for membership_type in self.channel_membership_types)
+
+    def is_channel_selected(self, channel):
+        if self.channel_membership_types and channel.get(
+                'membershipType', 'standard') not in self.channel_membership_types:
+            return False
+        return not (self.exclude_archived and channel.get('isArchived'))
@@ -1,50 +1,68 @@
-import os
+import threading
 from datetime import timedelta
 
 import humps
 import singer
 import singer.metrics
 from singer.utils import now, strptime_to_utc
-from tap_ms_teams.client import GraphVersion
+from tap_ms_teams.client import (CircuitOpenError, GraphVersion,
+                                 ResourceUnavailableError, Server5xxError)
+from tap_ms_teams.parent_index import get_parent_index
+from tap_ms_teams.schema_registry import get_schema
+from tap_ms_teams.scope import HierarchyScope
 from tap_ms_teams.transform import transform
 
 LOGGER = singer.get_logger()
-TOP_API_PARAM_DEFAULT = 100
+STATE_LOCK = threading.RLock()
 
 
 class GraphStream:
-    # pylint: disable=too-many-instance-attributes,no-member
-    def __init__(self, client=None, config=None, catalog=None, state=None):
+    # pylint: disable=too-many-instance-attributes,too-many-public-methods,no-member
+    delta_endpoint = None
+    # Parent ids injected into records of child streams
+    parent_properties = []
+
+    def __init__(self,
+                 client=None,
+                 config=None,
+                 catalog=None,
+                 state=None,
+                 checkpointer=None):
         self.client = client
         self.config = config
         self.catalog = catalog
         self.state = state
-        self.top = TOP_API_PARAM_DEFAULT
-
-    @staticmethod
-    def get_abs_path(path):
-        return os.path.join(os.path.dirname(os.path.realpath(__file__)), path)
+        self.checkpointer = checkpointer
 
     def load_schema(self):
-        schema_path = self.get_abs_path('schemas')
-        # pylint: disable=no-member
-        return singer.utils.load_json('{}/{}.json'.format(
-            schema_path, self.name))
+        return get_schema(self.name)
 
-    def write_schema(self):
-        schema = self.load_schema()
+    # Syncs pass the schema from the catalog, which is already parsed
+    def write_schema(self, schema=None):
+        if schema is None:
+            schema = self.load_schema()
         # pylint: disable=no-member
         return singer.write_schema(stream_name=self.name,
                                    schema=schema,
                                    key_properties=self.key_properties)
 
+    # With a checkpointer, state is only marked dirty and written when due
     def write_state(self):
-        return singer.write_state(self.state)
+        if self.checkpointer is None:
+            return singer.write_state(self.state)
+        return self.checkpointer.checkpoint()
+
+    # State is shared by streams syncing concurrently
+    def get_state_lock(self):
+        if self.checkpointer is None:
+            return STATE_LOCK
+        return self.checkpointer.lock
 
     def update_bookmark(self, stream, value):
-        if 'bookmarks' not in self.state:
-            self.state['bookmarks'] = {}
-        self.state['bookmarks'][stream] = value
+        with self.get_state_lock():
+            if 'bookmarks' not in self.state:
+                self.state['bookmarks'] = {}
+            self.state['bookmarks'][stream] = value
         LOGGER.info('Stream: %s - Write state, bookmark value: %s', stream, value)
         self.write_state()
 
@@ -54,16 +72,57 @@ class GraphStream:
             return default
         return self.state.get('bookmarks', {}).get(stream, default)
 
+    # Runs in a row whose bookmark was held back by skipped children
+    def get_held_runs(self):
+        return (self.state or {}).get('bookmark_held_runs', {}).get(
+            self.name, 0)
+
+    def update_held_runs(self, value):
+        with self.get_state_lock():
+            held_runs = self.state.setdefault('bookmark_held_runs', {})
+            if value:
+                held_runs[self.name] = value
+            else:
+                held_runs.pop(self.name, None)
+
+    # Request statistics of the last run, used by --plan
+    def update_run_stats(self, stats):
+        with self.get_state_lock():
+            if 'run_stats' not in self.state:
+                self.state['run_stats'] = {}
+            self.state['run_stats'][self.name] = stats
+
+    def update_delta_link(self, stream, value):
+        with self.get_state_lock():
+            if 'delta_links' not in self.state:
+                self.state['delta_links'] = {}
+            self.state['delta_links'][stream] = value
+        LOGGER.info('Stream: %s - Write state, delta link updated', stream)
+
+    def get_delta_link(self, stream):
+        if (self.state is None) or ('delta_links' not in self.state):
+            return None
+        return self.state.get('delta_links', {}).get(stream)
+
     # Currently syncing sets the stream currently being delivered in the state.
     # If the integration is interrupted, this state property is used to identify
     #  the starting point to continue from.
     # Reference: https://github.com/singer-io/singer-python/blob/master/singer/bookmarks.py#L41-L46
+    # With a checkpointer, streams may sync concurrently and it tracks which
+    #  stream currently_syncing should point at. Stream boundaries are always
+    #  checkpointed.
     def update_currently_syncing(self, stream_name):
-        if (stream_name is None) and ('currently_syncing' in self.state):
-            del self.state['currently_syncing']
+        if self.checkpointer is not None:
+            if stream_name is None:
+                self.checkpointer.finish_stream(self.name)
+            else:
+                self.checkpointer.start_stream(stream_name)
         else:
-            singer.set_currently_syncing(self.state, stream_name)
-        singer.write_state(self.state)
+            if (stream_name is None) and ('currently_syncing' in self.state):
+                del self.state['currently_syncing']
+            else:
+                singer.set_currently_syncing(self.state, stream_name)
+            singer.write_state(self.state)
         LOGGER.info('Stream: %s - Currently Syncing', stream_name)
 
     # Returns max key and date time for all replication key data in record
@@ -75,6 +134,21 @@ class GraphStream:
         max_key = max(date_times)
         return date_times[max_key]
 
+    # Returns True when a parent resource has had no activity since startdate,
+    # so traversal of its children can be skipped on an incremental run
+    @staticmethod
+    def is_unchanged_since(resource, key, startdate):
+        if not startdate or not resource.get(key):
+            return False
+        return strptime_to_utc(resource.get(key)) < strptime_to_utc(startdate)
+
+    # Server-side $filter on the replication key, only where the config opts in
+    def get_delivered_filter(self, startdate):
+        if not startdate or not (self.config or {}).get('filter_conversations'):
+            return None
+        return self.filter_param.format(replication_key=humps.camelize(
+            self.replication_key), startdate=startdate)
+
     def remove_hours_local(self, dttm): # pylint: disable = no-self-use
         new_dttm = dttm.replace(hour=0, minute=0, second=0, microsecond=0)
         return new_dttm
@@ -110,11 +184,47 @@ class GraphStream:
     def sync(self, client, startdate=None):
         resources = client.get_all_resources(self.version,
                                              self.endpoint,
-                                             top=self.top,
                                              orderby=self.orderby)
 
         yield humps.decamelize(resources)
 
+    # Directory streams may be replicated from a delta query instead of
+    # re-listing every object. Only enabled through config.
+    def use_delta(self):
+        return bool((self.config or {}).get('directory_delta')) and \
+            self.delta_endpoint is not None
+
+    # Emits objects added, changed or removed since the stored deltaLink.
+    # Updates are partial records: Graph only guarantees the changed
+    # properties, the others are left out rather than sent as null.
+    # full_resync discards the stored deltaLink and starts a new round.
+    # The deltaLink is only saved once the page has been consumed.
+    def sync_delta(self, client):
+        delta_link = None
+        if not self.config.get('full_resync'):
+            delta_link = self.get_delta_link(self.name)
+        LOGGER.info('Stream: %s - Delta query from %s', self.name,
+                    'stored delta link' if delta_link else 'initial round')
+
+        resources, next_delta_link = client.get_delta_resources(
+            self.version, self.delta_endpoint, delta_link=delta_link)
+
+        records = []
+        for resource in resources:
+            if not self.is_delta_resource_selected(resource):
+                continue
+            if '@removed' in resource:
+                del resource['@removed']
+                resource['_sdc_deleted_at'] = singer.utils.strftime(now())
+            records.append(resource)
+
+        yield humps.decamelize(records)
+        if next_delta_link:
+            self.update_delta_link(self.name, next_delta_link)
+
+    def is_delta_resource_selected(self, resource):
+        return True
+
 
 class Users(GraphStream):
     name = 'users'
@@ -123,10 +233,16 @@ class Users(GraphStream):
     replication_method = 'FULL_TABLE'
     replication_key = None
     endpoint = 'users'
+    delta_endpoint = 'users/delta'
     valid_replication_keys = []
     date_fields = []
     orderby = 'displayName'
 
+    def sync(self, client, startdate=None):
+        if self.use_delta():
+            return self.sync_delta(client)
+        return super().sync(client, startdate)
+
 
 class Groups(GraphStream):
     name = 'groups'
@@ -135,28 +251,119 @@ class Groups(GraphStream):
     replication_method = 'FULL_TABLE'
     replication_key = None
     endpoint = 'groups'
+    delta_endpoint = 'groups/delta'
     valid_replication_keys = []
     date_fields = []
     orderby = None
 
+    team_filter_param = "resourceProvisioningOptions/Any(x:x eq 'Team')"
+    team_endpoint = 'teams/{group_id}'
+    team_ids = None
+
     # Get all groups with filter for teams with resourceProvisioningOptions
     # Ensures we get only Team groups
     # See, https://docs.microsoft.com/en-us/graph/known-issues#missing-teams-in-list-all-teams
+    # Groups outside the configured scope are dropped here, before any child
+    # stream requests their resources
     def get_all_groups(self, client):
-        return client.get_all_resources(
-            self.version,
-            Groups.endpoint,
-            top=self.top,
-            filter_param="resourceProvisioningOptions/Any(x:x eq 'Team')")
+        return list(self.get_groups_in_scope(client))
+
+    def get_groups_in_scope(self, client):
+        scope = HierarchyScope(self.config)
+        for filter_param in scope.get_group_filters(self.team_filter_param):
+            for page in client.get_resource_pages(self.version,
+                                                  Groups.endpoint,
+                                                  filter_param=filter_param):
+                for group in page:
+                    if not scope.is_group_selected(group):
+                        continue
+                    if scope.exclude_archived and self.is_team_archived(
+                            client, group.get('id')):
+                        continue
+                    yield group
+
+    # (group_id,) for every team in scope, for child stream traversals
+    def get_group_index(self, client):
+        def build(index):
+            for group in self.get_groups_in_scope(client):
+                index.add((group.get('id'),))
+
+        return get_parent_index(
+            self.config,
+            'groups',
+            1,
+            build,
+            fingerprint=HierarchyScope(self.config).fingerprint())
+
+    # isArchived is only available on the team resource. Teams that cannot be
+    # read are reported and left out like archived ones, as skipped parents so
+    # their previously seen children are kept. Server errors and open circuits
+    # are deferred skips: the stream is incomplete and its bookmark held until
+    # the team can be read again.
+    def is_team_archived(self, client, group_id):
+        endpoint = self.team_endpoint.format(group_id=group_id)
+        parent = {'group_id': group_id}
+        try:
+            team = client.get_resource(GraphVersion.V1.value,
+                                       endpoint,
+                                       select='isArchived')
+        except ResourceUnavailableError as err:
+            client.skip(endpoint,
+                        'forbidden' if err.status_code == 403 else 'not_found',
+                        err, parent)
+            return True
+        except Server5xxError as err:
+            client.skip(endpoint, 'server_error', err, parent)
+            return True
+        except CircuitOpenError as err:
+            client.skip(endpoint, 'circuit_open', err, parent)
+            return True
+        return bool(team and team.get('isArchived'))
 
     def sync(self, client, startdate=None):
-        yield humps.decamelize(self.get_all_groups(client))
+        if self.use_delta():
+            return self.sync_delta(client)
+        return iter([humps.decamelize(self.get_all_groups(client))])
+
+    # Ids of the teams in scope seen by the delta query, kept in state next
+    # to the deltaLink. A new delta round starts from an empty set.
+    def sync_delta(self, client):
+        team_ids = []
+        if self.state and not self.config.get('full_resync') and \
+                self.get_delta_link(self.name):
+            team_ids = self.state.get('delta_team_ids', [])
+        self.team_ids = set(team_ids)
+        return super().sync_delta(client)
+
+    def update_delta_link(self, stream, value):
+        with self.get_state_lock():
+            self.state['delta_team_ids'] = sorted(self.team_ids)
+        super().update_delta_link(stream, value)
+
+    # groups/delta does not support the resourceProvisioningOptions filter,
+    # and updates only carry the properties that changed, so the Team
+    # restriction and the configured scope are applied against the ids of
+    # teams seen so far. Updates and removals of other groups are dropped.
+    def is_delta_resource_selected(self, resource):
+        group_id = resource.get('id')
+        options = resource.get('resourceProvisioningOptions')
+        selected = group_id in self.team_ids
+        if options is not None:
+            selected = 'Team' in options
+        selected = selected and \
+            HierarchyScope(self.config).is_group_selected(resource)
+        if selected and '@removed' not in resource:
+            self.team_ids.add(group_id)
+        else:
+            self.team_ids.discard(group_id)
+        return selected
 
 
 class GroupMembers(GraphStream):
     name = 'group_members'
     version = GraphVersion.V1.value
     key_properties = ['id']
+    parent_properties = ['group_id']
     replication_method = 'FULL_TABLE'
     replication_key = None
     endpoint = 'groups/{group_id}/members'
@@ -166,13 +373,15 @@ class GroupMembers(GraphStream):
 
     def sync(self, client, startdate=None):
         owners_result = []
-        for group in Groups().get_all_groups(client):
-            resources = client.get_all_resources(
-                self.version, self.endpoint.format(group_id=group.get('id')))
+        for (group_id,) in Groups(config=self.config).get_group_index(client):
+            resources = client.get_child_resources(
+                self.version,
+                self.endpoint.format(group_id=group_id),
+                parent={'group_id': group_id})
 
             # Inject group id
             for owner in resources:
-                owner['group_id'] = group.get('id')
+                owner['group_id'] = group_id
 
             transformed_resources = humps.decamelize(resources)
             owners_result.extend(transformed_resources)
@@ -183,6 +392,7 @@ class GroupOwners(GraphStream):
     name = 'group_owners'
     version = GraphVersion.V1.value
     key_properties = ['id']
+    parent_properties = ['group_id']
     replication_method = 'FULL_TABLE'
     replication_key = None
     endpoint = 'groups/{group_id}/owners'
@@ -192,13 +402,15 @@ class GroupOwners(GraphStream):
 
     def sync(self, client, startdate=None):
         owners_result = []
-        for group in Groups().get_all_groups(client):
-            resources = client.get_all_resources(
-                self.version, self.endpoint.format(group_id=group.get('id')))
+        for (group_id,) in Groups(config=self.config).get_group_index(client):
+            resources = client.get_child_resources(
+                self.version,
+                self.endpoint.format(group_id=group_id),
+                parent={'group_id': group_id})
 
             # Inject group id
             for owner in resources:
-                owner['group_id'] = group.get('id')
+                owner['group_id'] = group_id
 
             transformed_resources = humps.decamelize(resources)
             owners_result.extend(transformed_resources)
@@ -218,9 +430,9 @@ class TeamDrives(GraphStream):
 
     def sync(self, client, startdate=None):
         owners_result = []
-        for group in Groups().get_all_groups(client):
-            resources = client.get_all_resources(
-                self.version, self.endpoint.format(group_id=group.get('id')))
+        for (group_id,) in Groups(config=self.config).get_group_index(client):
+            resources = client.get_child_resources(
+                self.version, self.endpoint.format(group_id=group_id))
 
             transformed_resources = humps.decamelize(resources)
             owners_result.extend(transformed_resources)
@@ -237,26 +449,55 @@ class Channels(GraphStream):
     valid_replication_keys = []
     date_fields = []
     orderby = 'displayName'
+    parent_properties = ['group_id']
 
     def sync(self, client, startdate=None):
-        channels_result = []
-        for group in Groups().get_all_groups(client):
-            resources = client.get_all_resources(
-                self.version, self.endpoint.format(group_id=group.get('id')))
-
-            transformed_resources = humps.decamelize(resources)
-            channels_result.extend(transformed_resources)
-            yield channels_result
-
+        for (group_id,) in Groups(config=self.config).get_group_index(client):
+            resources = self.get_all_channels_for_group(client, group_id)
+            for channel in resources:
+                channel['group_id'] = group_id
+
+            yield humps.decamelize(resources)
+
+    # (group_id, channel_id) for every channel in scope, for child stream
+    #  traversals
+    def get_channel_index(self, client):
+        def build(index):
+            for (group_id,) in Groups(
+                    config=self.config).get_group_index(client):
+                for channel in self.get_all_channels_for_group(
+                        client, group_id):
+                    index.add((group_id, channel.get('id')))
+            # Teams whose channels could not be listed this time
+            index.complete = not client.stats.is_incomplete()
+
+        return get_parent_index(
+            self.config,
+            'channels',
+            2,
+            build,
+            fingerprint=HierarchyScope(self.config).fingerprint())
+
+    # Channels outside the configured scope are dropped before any child
+    # stream requests their resources
     def get_all_channels_for_group(self, client, group_id):
-        return client.get_all_resources(
-            self.version, self.endpoint.format(group_id=group_id))
+        scope = HierarchyScope(self.config)
+        channels = client.get_child_resources(
+            self.version,
+            self.endpoint.format(group_id=group_id),
+            parent={'group_id': group_id},
+            filter_param=scope.get_channel_filter())
+        return [
+            channel for channel in channels
+            if scope.is_channel_selected(channel)
+        ]
 
 
 class ChannelMembers(GraphStream):
     name = 'channel_members'
     version = GraphVersion.BETA.value
     key_properties = ['id']
+    parent_properties = ['channel_id']
     replication_method = 'FULL_TABLE'
     replication_key = None
     endpoint = 'chats/{channel_id}/members'
@@ -267,28 +508,26 @@ class ChannelMembers(GraphStream):
     def sync(self, client, startdate=None):
         result = []
 
-        for group in Groups().get_all_groups(client):
-            group_id = group.get('id')
-
-            for channel in Channels().get_all_channels_for_group(
-                    client, group_id):
-                channel_id = channel.get('id')
-
-                for member in self.get_channel_members(client, channel_id):
-                    member['channel_id'] = channel.get('id')
-                    result.append(member)
+        for _, channel_id in Channels(
+                config=self.config).get_channel_index(client):
+            for member in self.get_channel_members(client, channel_id):
+                member['channel_id'] = channel_id
+                result.append(member)
 
         yield humps.decamelize(result)
 
     def get_channel_members(self, client, channel_id):
-        return client.get_all_resources(
-            self.version, self.endpoint.format(channel_id=channel_id))
+        return client.get_child_resources(
+            self.version,
+            self.endpoint.format(channel_id=channel_id),
+            parent={'channel_id': channel_id})
 
 
 class ChannelTabs(GraphStream):
     name = 'channel_tabs'
     version = GraphVersion.V1.value
     key_properties = ['id']
+    parent_properties = ['group_id', 'channel_id']
     replication_method = 'FULL_TABLE'
     replication_key = None
     endpoint = 'teams/{group_id}/channels/{channel_id}/tabs'
@@ -298,22 +537,21 @@ class ChannelTabs(GraphStream):
     def sync(self, client, startdate=None):
         result = []
 
-        for group in Groups().get_all_groups(client):
-            group_id = group.get('id')
-
-            for channel in Channels().get_all_channels_for_group(
-                    client, group_id):
-                channel_id = channel.get('id')
-
-                channel_tabs = client.get_all_resources(
-                    self.version,
-                    self.endpoint.format(group_id=group_id,
-                                         channel_id=channel_id))
-                for tab in channel_tabs:
-                    tab['group_id'] = group_id
-                    tab['channel_id'] = channel_id
-
-                result.extend(channel_tabs)
+        for group_id, channel_id in Channels(
+                config=self.config).get_channel_index(client):
+            channel_tabs = client.get_child_resources(
+                self.version,
+                self.endpoint.format(group_id=group_id,
+                                     channel_id=channel_id),
+                parent={
+                    'group_id': group_id,
+                    'channel_id': channel_id
+                })
+            for tab in channel_tabs:
+                tab['group_id'] = group_id
+                tab['channel_id'] = channel_id
+
+            result.extend(channel_tabs)
         yield humps.decamelize(result)
 
 
@@ -339,22 +577,16 @@ class ChannelMessages(GraphStream):
 
     def sync(self, client, startdate=None):
         result = []
-        for group in Groups().get_all_groups(client):
-
-            channels = client.get_all_resources(
-                Channels.version,
-                Channels.endpoint.format(group_id=group.get('id')))
-
-            for channel in channels:
-                channel_messages = self.get_messages_for_group_channel(
-                    client,
-                    group_id=group.get('id'),
-                    channel_id=channel.get('id'),
-                    startdate=startdate)
-
-                transformed_channel_messages = humps.decamelize(
-                    channel_messages)
-                result.extend(transformed_channel_messages)
+        for group_id, channel_id in Channels(
+                config=self.config).get_channel_index(client):
+            channel_messages = self.get_messages_for_group_channel(
+                client,
+                group_id=group_id,
+                channel_id=channel_id,
+                startdate=startdate)
+
+            transformed_channel_messages = humps.decamelize(channel_messages)
+            result.extend(transformed_channel_messages)
         yield result
 
     def get_messages_for_group_channel(self, client, group_id, channel_id,
@@ -362,11 +594,10 @@ class ChannelMessages(GraphStream):
         filter_param = self.filter_param.format(replication_key=humps.camelize(
             self.replication_key), startdate=startdate)
         endpoint = self.endpoint.format(group_id=group_id,
-                                        channel_id=channel_id,
-                                        top=self.top)
-        return client.get_all_resources(self.version,
-                                        endpoint,
-                                        filter_param=filter_param)
+                                        channel_id=channel_id)
+        return client.get_child_resources(self.version,
+                                          endpoint,
+                                          filter_param=filter_param)
 
 
 class ChannelMessageReplies(GraphStream):
@@ -381,34 +612,85 @@ class ChannelMessageReplies(GraphStream):
     ]
     date_fields = []
     orderby = None
+    messages_endpoint = 'teams/{group_id}/channels/{channel_id}/messages'
+    # Inline replies are only available on the messages list, not on the
+    # delta endpoint used by channel_messages
+    # See, https://docs.microsoft.com/en-us/graph/api/channel-list-messages?view=graph-rest-beta&tabs=http
+    expand = 'replies'
 
     def sync(self, client, startdate=None):
         results = []
 
-        for group in Groups().get_all_groups(client):
-            group_id = group.get('id')
-
-            for channel in Channels().get_all_channels_for_group(
-                    client, group_id=group_id):
-                channel_id = channel.get('id')
-
-                for message in ChannelMessages(
-                        client).get_messages_for_group_channel(
-                            client,
-                            group_id=group_id,
-                            channel_id=channel_id,
-                            startdate=startdate):
-                    message_id = message.get('id')
+        for group_id, channel_id in Channels(
+                config=self.config).get_channel_index(client):
+            if self.expand_replies():
+                replies = self.get_expanded_replies_for_group_channel(
+                    client, group_id=group_id, channel_id=channel_id)
+            else:
+                replies = self.get_paged_replies_for_group_channel(
+                    client,
+                    group_id=group_id,
+                    channel_id=channel_id,
+                    startdate=startdate)
 
-                    replies = client.get_all_resources(
-                        self.version,
-                        self.endpoint.format(group_id=group_id,
-                                             channel_id=channel_id,
-                                             message_id=message_id))
-                    results.extend(replies)
+            for reply in replies:
+                reply['group_id'] = group_id
+                reply['channel_id'] = channel_id
+            results.extend(replies)
 
         yield humps.decamelize(results)
 
+    # The messages list cannot be filtered by date and would be read in full
+    # on every run, so it is only used for the initial sync. Once there is a
+    # bookmark, replies follow the filtered channel_messages delta query.
+    def expand_replies(self):
+        if self.get_bookmark(self.name, None) is not None:
+            return False
+        if self.config is None:
+            return True
+        return self.config.get('expand_replies', True)
+
+    # Fetch messages with their replies inlined, one request per page of
+    # messages. Graph truncates the inline collection on busy threads, in
+    # which case replies@odata.nextLink is present and we page that message.
+    def get_expanded_replies_for_group_channel(self, client, group_id,
+                                               channel_id):
+        replies = []
+        messages = client.get_child_resources(
+            self.version,
+            self.messages_endpoint.format(group_id=group_id,
+                                          channel_id=channel_id),
+            expand=self.expand)
+        for message in messages:
+            if message.get('replies@odata.nextLink'):
+                replies.extend(
+                    self.get_replies_for_message(client, group_id, channel_id,
+                                                 message.get('id')))
+            else:
+                replies.extend(message.get('replies') or [])
+        return replies
+
+    def get_paged_replies_for_group_channel(self, client, group_id,
+                                            channel_id, startdate):
+        replies = []
+        for message in ChannelMessages(client).get_messages_for_group_channel(
+                client,
+                group_id=group_id,
+                channel_id=channel_id,
+                startdate=startdate):
+            replies.extend(
+                self.get_replies_for_message(client, group_id, channel_id,
+                                             message.get('id')))
+        return replies
+
+    def get_replies_for_message(self, client, group_id, channel_id,
+                                message_id):
+        return client.get_child_resources(
+            self.version,
+            self.endpoint.format(group_id=group_id,
+                                 channel_id=channel_id,
+                                 message_id=message_id))
+
 
 class Conversations(GraphStream):
     name = 'conversations'
@@ -420,22 +702,24 @@ class Conversations(GraphStream):
     valid_replication_keys = ['last_delivered_date_time']
     date_fields = []
     orderby = 'displayName'
+    filter_param = '{replication_key} gt {startdate}'
 
     def sync(self, client, startdate=None):
         results = []
-        for group in Groups().get_all_groups(client):
-            group_id = group.get('id')
+        for (group_id,) in Groups(config=self.config).get_group_index(client):
             conversations = self.get_conversations_for_group(
-                client, group_id=group.get('id'))
+                client, group_id=group_id, startdate=startdate)
             for conversation in conversations:
                 conversation['group_id'] = group_id
             results.extend(conversations)
 
         yield humps.decamelize(results)
 
-    def get_conversations_for_group(self, client, group_id):
-        return client.get_all_resources(
-            self.version, self.endpoint.format(group_id=group_id))
+    def get_conversations_for_group(self, client, group_id, startdate=None):
+        return client.get_child_resources(
+            self.version,
+            self.endpoint.format(group_id=group_id),
+            filter_param=self.get_delivered_filter(startdate))
 
 
 class ConversationThreads(GraphStream):
@@ -448,16 +732,24 @@ class ConversationThreads(GraphStream):
     valid_replication_keys = ['last_delivered_date_time']
     date_fields = []
     orderby = 'displayName'
+    filter_param = '{replication_key} gt {startdate}'
 
     def sync(self, client, startdate=None):
         result = []
-        for group in Groups().get_all_groups(client):
-            group_id = group.get('id')
-            for conversation in Conversations().get_conversations_for_group(
-                    client, group_id=group_id):
+        for (group_id,) in Groups(config=self.config).get_group_index(client):
+            for conversation in Conversations(
+                    config=self.config).get_conversations_for_group(
+                        client, group_id=group_id, startdate=startdate):
+                # No thread in a conversation can be newer than the
+                # conversation's last delivery
+                if self.is_unchanged_since(conversation,
+                                           'lastDeliveredDateTime',
+                                           startdate):
+                    continue
                 conversation_id = conversation.get('id')
                 threads = self.get_threads_for_group(client, group_id,
-                                                     conversation_id)
+                                                     conversation_id,
+                                                     startdate=startdate)
                 for thread in threads:
                     thread['group_id'] = group_id
                     thread['conversation_id'] = conversation_id
@@ -465,11 +757,13 @@ class ConversationThreads(GraphStream):
                 result.extend(threads)
         yield humps.decamelize(result)
 
-    def get_threads_for_group(self, client, group_id, conversation_id):
-        return client.get_all_resources(
+    def get_threads_for_group(self, client, group_id, conversation_id,
+                              startdate=None):
+        return client.get_child_resources(
             self.version,
             self.endpoint.format(group_id=group_id,
-                                 conversation_id=conversation_id))
+                                 conversation_id=conversation_id),
+            filter_param=self.get_delivered_filter(startdate))
 
 
 class ConversationPosts(GraphStream):
@@ -486,18 +780,29 @@ class ConversationPosts(GraphStream):
     def sync(self, client, startdate=None):
         result = []
 
-        for group in Groups().get_all_groups(client):
-            group_id = group.get('id')
-
-            for conversation in Conversations().get_conversations_for_group(
-                    client, group_id=group_id):
+        for (group_id,) in Groups(config=self.config).get_group_index(client):
+            for conversation in Conversations(
+                    config=self.config).get_conversations_for_group(
+                        client, group_id=group_id, startdate=startdate):
+                # Skip subtrees with no delivery since the bookmark
+                if self.is_unchanged_since(conversation,
+                                           'lastDeliveredDateTime',
+                                           startdate):
+                    continue
                 conversation_id = conversation.get('id')
 
-                for thread in ConversationThreads().get_threads_for_group(
-                        client, group_id=group_id,
-                        conversation_id=conversation_id):
+                for thread in ConversationThreads(
+                        config=self.config).get_threads_for_group(
+                            client,
+                            group_id=group_id,
+                            conversation_id=conversation_id,
+                            startdate=startdate):
+                    if self.is_unchanged_since(thread,
+                                               'lastDeliveredDateTime',
+                                               startdate):
+                        continue
                     thread_id = thread.get('id')
-                    posts = client.get_all_resources(
+                    posts = client.get_child_resources(
                         self.version,
                         self.endpoint.format(group_id=group_id,
                                              conversation_id=conversation_id,
@@ -0,0 +1,211 @@
+import time
+
+import singer
+from singer import Transformer, metadata
+from singer.utils import strftime, strptime_to_utc
+from tap_ms_teams.batch import (BATCH_MAX_BYTES_DEFAULT,
+                                BATCH_MAX_RECORDS_DEFAULT, BatchWriter)
+from tap_ms_teams.change_store import ChangeStore
+from tap_ms_teams.checkpoint import (CHECKPOINT_INTERVAL_DEFAULT,
+                                     CHECKPOINT_RECORDS_DEFAULT, Checkpointer)
+from tap_ms_teams.client import PageSizer
+from tap_ms_teams.profiling import (PROFILE_SAMPLE_INTERVAL_DEFAULT,
+                                    PROFILE_TOP_N_DEFAULT, StreamProfiler)
+from tap_ms_teams.scheduler import (MAX_CONCURRENT_STREAMS_DEFAULT,
+                                    StreamScheduler)
+from tap_ms_teams.streams import AVAILABLE_STREAMS
+
+LOGGER = singer.get_logger()
+
+MAX_BOOKMARK_HELD_RUNS_DEFAULT = 3
+
+
+# Only FULL_TABLE streams that re-list everything benefit from change
+# suppression; delta streams already emit changes only
+def get_change_store(config, stream):
+    if not config.get('change_store_dir'):
+        return None
+    if stream.replication_method != 'FULL_TABLE' or stream.use_delta():
+        return None
+    return ChangeStore(config['change_store_dir'],
+                       stream.name,
+                       stream.key_properties,
+                       parent_properties=stream.parent_properties,
+                       max_entries=config.get('change_store_max_entries'))
+
+
+# In batch mode records go to compressed files announced with BATCH messages
+def get_batch_writer(config, stream, checkpointer):
+    if not config.get('batch_dir'):
+        return None
+    return BatchWriter(config['batch_dir'],
+                       stream.name,
+                       checkpointer=checkpointer,
+                       max_records=config.get('batch_max_records',
+                                              BATCH_MAX_RECORDS_DEFAULT),
+                       max_bytes=config.get('batch_max_bytes',
+                                            BATCH_MAX_BYTES_DEFAULT))
+
+
+# Children of skipped parents may still exist, so their entries are carried
+# over rather than tombstoned; 404s are real deletions. In batch mode the
+# store is only committed once the files holding its records are closed and
+# announced, otherwise records lost with an unannounced file would never be
+# emitted again.
+def commit_change_store(config, client, stream, change_store, write_record,
+                        counter, batch_writer=None):
+    skipped_parents = client.stats.get_skipped_parents()
+    if skipped_parents:
+        LOGGER.warning(
+            'Stream: %s - Keeping change store entries of %s skipped parents',
+            stream.name, len(skipped_parents))
+        change_store.keep_parents(skipped_parents)
+    if config.get('emit_tombstones'):
+        for tombstone in change_store.get_tombstones():
+            write_record(stream.name, tombstone)
+            counter.increment()
+    if batch_writer:
+        batch_writer.close()
+    change_store.commit()
+
+
+# Children skipped until the next run may hold records older than the new
+# bookmark, so it is kept back, but for at most max_bookmark_held_runs runs
+# in a row so that a child failing on every run does not freeze the stream.
+# Returns True when the bookmark was held back.
+def update_stream_bookmark(config, client, stream, value):
+    if client.stats.is_incomplete() and stream.get_held_runs() < config.get(
+            'max_bookmark_held_runs', MAX_BOOKMARK_HELD_RUNS_DEFAULT):
+        LOGGER.warning('Stream: %s - Skipped resources, bookmark not advanced',
+                       stream.name)
+        return True
+    stream.update_bookmark(stream.name, value)
+    return False
+
+
+def sync_stream(client, config, catalog, state, catalog_entry, transformer,
+                checkpointer):
+    stream = AVAILABLE_STREAMS[catalog_entry.stream](client=client,
+                                                     config=config,
+                                                     catalog=catalog,
+                                                     state=state,
+                                                     checkpointer=checkpointer)
+    LOGGER.info('Syncing stream: %s', catalog_entry.stream)
+
+    stream.update_currently_syncing(stream.name)
+    client.stats.start_stream()
+    started_at = time.time()
+    stream_schema = catalog_entry.schema.to_dict()
+    stream.write_schema(stream_schema)
+    stream_metadata = metadata.to_map(catalog_entry.metadata)
+
+    bookmark_date = stream.get_bookmark(stream.name, config['start_date'])
+    bookmark_dttm = strptime_to_utc(bookmark_date)
+    max_bookmark_value = None
+    change_store = get_change_store(config, stream)
+    batch_writer = get_batch_writer(config, stream, checkpointer)
+    if batch_writer:
+        write_record = batch_writer.write_record
+    else:
+        write_record = singer.write_record
+
+    with singer.metrics.record_counter(endpoint=stream.name) as counter:
+        if stream.replication_method == 'FULL_TABLE':
+            for page in stream.sync(client):
+                for record in page:
+                    transformed_record = transformer.transform(
+                        record,
+                        stream_schema,
+                        stream_metadata,
+                    )
+                    if change_store and not change_store.is_changed(
+                            transformed_record):
+                        continue
+                    write_record(catalog_entry.stream, transformed_record)
+                    counter.increment()
+                    checkpointer.increment()
+            if change_store:
+                commit_change_store(config, client, stream, change_store,
+                                    write_record, counter, batch_writer)
+        else:
+            bookmark_held = False
+            for page in stream.sync(client, bookmark_date):
+                for record in page:
+                    if not max_bookmark_value:
+                        max_bookmark_value = bookmark_date
+                    max_bookmark_dttm = strptime_to_utc(max_bookmark_value)
+
+                    record_timestamp = stream.max_from_replication_dates(
+                        record)
+                    if record_timestamp > max_bookmark_dttm:
+                        max_bookmark_value = strftime(record_timestamp)
+
+                    if record_timestamp >= bookmark_dttm:
+                        write_record(
+                            catalog_entry.stream,
+                            transformer.transform(
+                                record,
+                                stream_schema,
+                                stream_metadata,
+                            ))
+                        counter.increment()
+                        checkpointer.increment()
+                bookmark_held = update_stream_bookmark(
+                    config, client, stream, max_bookmark_value)
+            stream.update_held_runs(
+                stream.get_held_runs() + 1 if bookmark_held else 0)
+    if batch_writer:
+        batch_writer.close()
+    skipped = client.stats.get_skipped()
+    if skipped:
+        LOGGER.warning('Stream: %s - Skipped resources: %s', stream.name,
+                       skipped)
+    stream.update_run_stats({
+        'seconds': time.time() - started_at,
+        'skipped': skipped,
+        'families': client.stats.finish_stream()
+    })
+    stream.update_currently_syncing(None)
+
+
+def sync(client, config, catalog, state):
+    LOGGER.info('Starting Sync..')
+    selected_streams = list(catalog.get_selected_streams(state))
+
+    checkpointer = Checkpointer(
+        state,
+        interval=config.get('state_checkpoint_interval',
+                            CHECKPOINT_INTERVAL_DEFAULT),
+        max_records=config.get('state_checkpoint_records',
+                               CHECKPOINT_RECORDS_DEFAULT))
+
+    # Page sizes tuned on previous runs are kept in state
+    if 'page_sizes' not in state:
+        state['page_sizes'] = {}
+    client.page_sizer = PageSizer(state['page_sizes'], lock=checkpointer.lock)
+
+    profiler = StreamProfiler(
+        config.get('profile_dir'),
+        mode=config.get('profile_mode', 'full'),
+        top_n=config.get('profile_top_n', PROFILE_TOP_N_DEFAULT),
+        sample_interval=config.get('profile_sample_interval',
+                                   PROFILE_SAMPLE_INTERVAL_DEFAULT))
+
+    max_workers = config.get('max_concurrent_streams',
+                             MAX_CONCURRENT_STREAMS_DEFAULT)
+    # cProfile and tracemalloc are process wide, so full profiles are only
+    # meaningful one stream at a time
+    if max_workers > 1 and profiler.directory and profiler.mode == 'full':
+        LOGGER.warning('profile_mode full syncs streams one at a time')
+        max_workers = 1
+
+    def sync_profiled_stream(catalog_entry):
+        with profiler.profile(catalog_entry.stream), \
+                Transformer() as transformer:
+            sync_stream(client, config, catalog, state, catalog_entry,
+                        transformer, checkpointer)
+
+    with checkpointer:
+        StreamScheduler(max_workers).run(selected_streams,
+                                         sync_profiled_stream)
+    LOGGER.info('Finished Sync..')